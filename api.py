@@ -1,16 +1,76 @@
 from urls import *
 from functions import split_parti_url
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from functools import lru_cache
 import requests
-import json
+import time
 
-def getUserId(platform:str,username:str)->bool:
-    resp=requests.get(USER_ID_ENPOINT.format(platform,username))
+# Seconds to wait on the parti.com API before giving up on a request
+REQUEST_TIMEOUT = 10
+
+# Seconds a live status answer is reused before asking the API again
+LIVE_CACHE_TTL = 5
+
+# One shared session so repeated polls reuse the same keep-alive connection
+_session = requests.Session()
+_session.headers.update({"User-Agent": "parti-archiver", "Accept-Encoding": "gzip, deflate"})
+# Transient failures are retried with backoff on the warm connection rather than
+# falling through to the archiver's long error sleep
+_retries = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504), allowed_methods=("GET",))
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=_retries)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+def get_session()->requests.Session:
+    """Return the shared session, e.g. to mount an adapter with custom retries"""
+    return _session
+
+def _get(url:str)->requests.Response:
+    return _session.get(url, timeout=REQUEST_TIMEOUT)
+
+# The id behind a (platform, username) pair doesn't change, so only look it up once
+@lru_cache(maxsize=32)
+def _resolve_user_id(platform:str,username:str)->str:
+    resp=_get(USER_ID_ENPOINT.format(platform,username))
+    resp.raise_for_status()
     return resp.content.decode()
 
+def getUserId(platform:str,username:str)->str:
+    return _resolve_user_id(platform,username)
+
+def refreshUserId(platform:str,username:str)->str:
+    """Drop any cached ids and look the user up again"""
+    _resolve_user_id.cache_clear()
+    return getUserId(platform,username)
+
+# user_id -> (monotonic time fetched, is live)
+_live_cache={}
+
 def isLive(user_id:str)->bool:
-    resp=requests.get(LIVE_INFO_ENDPOINT.format(user_id))
-    return json.loads(resp.content)["is_streaming_live_now"]
+    now=time.monotonic()
+    cached=_live_cache.get(user_id)
+    if cached and now-cached[0]<LIVE_CACHE_TTL:
+        return cached[1]
+    
+    resp=_get(LIVE_INFO_ENDPOINT.format(user_id))
+    resp.raise_for_status()
+    live=resp.json()["is_streaming_live_now"]
+    _live_cache[user_id]=(now,live)
+    return live
+
+# Lets callers force a fresh check, e.g. right after a stream ends
+isLive.cache_clear=_live_cache.clear
+
+def getLiveStatus(platform:str,username:str)->bool:
+    """Check if a user is live, only looking up their id when it isn't cached yet"""
+    user_id=getUserId(platform,username)
+    try:
+        return isLive(user_id)
+    except requests.HTTPError:
+        # The id may have changed on parti's side, look it up again and retry once
+        return isLive(refreshUserId(platform,username))
 
 if __name__=="__main__":
-    print(isLive(getUserId(*split_parti_url("https://parti.com/creator/parti/worldoftshirts2001"))))
-    
+    print(getLiveStatus(*split_parti_url("https://parti.com/creator/parti/worldoftshirts2001")))
+
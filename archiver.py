@@ -1,26 +1,21 @@
 from functions import split_parti_url
 from video import download_with_callback
 from chat import parti_chat
-from api import isLive, getUserId
+from api import isLive, getLiveStatus
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from logging.handlers import QueueHandler, QueueListener
 import threading
-import datetime
+import signal
 import time
 import sys
 import os
 import shutil
+import queue
+import atexit
 import logging
 import traceback
 import argparse
 
-# Configure root logger first
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("parti_archiver.log")  # Always log to file
-    ]
-)
-
 # Get logger for this module
 logger = logging.getLogger("parti_archiver")
 
@@ -28,6 +23,21 @@ logger = logging.getLogger("parti_archiver")
 DELAY = 120  # Seconds between checks for stream status
 CHAT_SHUTDOWN_TIMEOUT = 20  # Reduced from 60s to 20s since we've improved chat shutdown
 MAX_OFFLINE_CHECKS = 3  # Number of consecutive offline checks before considering stream ended
+TIMESTAMP_FORMAT = '%Y-%m-%d_%H-%M-%S'  # Used to name each stream session's directory
+LIVE_CHECK_INTERVAL = 30  # Seconds between live status checks while recording
+DOWNLOAD_CHECK_INTERVAL = 5  # Seconds between checks that the download thread is still alive
+
+# Set by the SIGINT handler so sleeping loops wake up and exit straight away
+_shutdown = threading.Event()
+
+def request_shutdown(signum=None, frame=None):
+    """
+    SIGINT handler that asks the archiver to stop at its next wakeup.
+    A second Ctrl+C raises KeyboardInterrupt as usual in case something is stuck.
+    """
+    if _shutdown.is_set():
+        raise KeyboardInterrupt()
+    _shutdown.set()
 
 def is_directory_empty(directory_path):
     """
@@ -73,13 +83,54 @@ def delete_directory(directory_path):
         logger.error(f"Failed to delete directory {directory_path}: {e}")
         return False
 
+def run_in_thread(fn, *args, name=None):
+    """
+    Run a function in a daemon thread and return a Future for its result.
+    
+    A ThreadPoolExecutor isn't used because it joins its workers at interpreter
+    exit, which would hang shutdown on a download that is still recording.
+    
+    Args:
+        fn: Function to run
+        *args: Arguments to pass to the function
+        name: Name for the thread
+        
+    Returns:
+        Future: Resolves to the function's return value, or raises its exception
+    """
+    future = Future()
+    
+    def runner():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+    
+    threading.Thread(target=runner, name=name, daemon=True).start()
+    return future
+
 def setup_logging(verbose):
-    """Configure logging based on verbosity level"""
-    # Root logger already set up with file handler
+    """
+    Configure logging based on verbosity level
+    
+    Records are handed to a background listener thread through a queue, so the
+    main, download and chat threads never block on log file or console writes.
+    
+    Returns:
+        QueueListener: The running listener, stop it to flush remaining records
+    """
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    # Always log to file. This is done here rather than at import time so that
+    # importing archive_stream doesn't attach a file handler for the caller
+    file_handler = logging.FileHandler("parti_archiver.log")
+    file_handler.setFormatter(formatter)
     
     # Define a console handler with appropriate level
     console_handler = logging.StreamHandler()
-    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    console_handler.setFormatter(formatter)
     
     if verbose:
         # In verbose mode, show all INFO level and above
@@ -96,39 +147,53 @@ def setup_logging(verbose):
         logging.getLogger("video_downloader").setLevel(logging.INFO)
         logging.getLogger("chat_monitor").setLevel(logging.INFO)
     
-    # Add console handler to root logger
-    logging.getLogger().addHandler(console_handler)
+    # Root logger only queues records, the listener thread does the actual writing
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(QueueHandler(log_queue))
     
     # Set parti_archiver logger level (our main module)
     if verbose:
         logger.setLevel(logging.DEBUG)
     else:
         logger.setLevel(logging.INFO)
+    
+    return listener
 
-def archive_stream(parti_url, base_dir="."):
+def archive_stream(parti_url, base_dir=".", shutdown_event=None, chat_json=False):
     """
     Archive a Parti.com stream (video and chat)
     
     Args:
         parti_url: URL to the Parti.com stream
+        base_dir: Directory where stream sessions are created
+        shutdown_event: Threading event that stops the archiver once set,
+            defaults to the one set by the SIGINT handler
+        chat_json: Also write each session's chat as a chat.json array
     """
+    if shutdown_event is None:
+        shutdown_event = _shutdown
+    
     platform, username = split_parti_url(parti_url)
-    logger.info(f"Starting archiver for {platform}/{username}")
+    logger.info("Starting archiver for %s/%s", platform, username)
     
-    offline_count = 0
+    offline_count = 0  # Consecutive offline checks, both between and during recordings
     
-    while True:
+    while not shutdown_event.is_set():
         
         try:
-            user_id = getUserId(platform, username)
-            is_streaming = isLive(user_id)
+            is_streaming = getLiveStatus(platform, username)
             
             if is_streaming:
                 # Reset offline counter if we detect the stream
                 offline_count = 0
                 
                 # Create directory for this stream session
-                timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+                timestamp = time.strftime(TIMESTAMP_FORMAT)
                 stream_dir = os.path.join(base_dir, f"{username}_{timestamp}")
                 os.makedirs(stream_dir, exist_ok=True)
                 print(f"Stream detected! Creating directory: {stream_dir}")  # Always show this
@@ -137,17 +202,14 @@ def archive_stream(parti_url, base_dir="."):
                 # Events for thread coordination
                 stop_event = threading.Event()  # Signals chat thread to stop
                 download_complete = threading.Event()  # Signals when download is done
-                download_success = threading.Event()  # Indicates if download was successful
+                chat_saved = threading.Event()  # Set by the chat thread once its files are written
                 
                 # Define callback for when download finishes
                 def on_download_complete(success=True):
-                    if success:
-                        download_success.set()
-                    
-                    logger.info("Download completed, starting post-download wait period...")
+                    logger.info(f"Download completed (success={success}), handing off to the main thread...")
                     download_complete.set()
                     
-                    # Don't stop chat immediately - we'll wait in the main thread
+                    # Setting the event wakes the main thread, which stops the chat - nothing to block on here
                 
                 # Wrapper to pass success status from video download thread
                 def download_thread_fn():
@@ -161,86 +223,80 @@ def archive_stream(parti_url, base_dir="."):
                         logger.error(f"Unhandled exception in download thread: {e}")
                         logger.debug(traceback.format_exc())
                         on_download_complete(False)
-                    except Exception as e:
-                        logger.error(f"Unhandled exception in download thread: {e}")
-                        logger.debug(traceback.format_exc())
-                        on_download_complete(False)
                 
-                # Create and start threads for video download and chat collection
-                dl_thread = threading.Thread(
-                    target=download_thread_fn,
-                    name="VideoDownload",
-                    daemon=True  # Mark as daemon so it doesn't prevent program exit
-                )
-                chat_thread = threading.Thread(
-                    target=parti_chat, 
-                    args=(platform, username, stream_dir, stop_event),
-                    name="ChatCollection",
-                    daemon=True  # Mark as daemon so it doesn't prevent program exit
-                )
-                
-                threads = [dl_thread, chat_thread]
-                
-                # Start each thread
+                # Start daemon threads for video download and chat collection
                 print(f"Starting download for {username}...")  # Always show this
                 logger.info("Starting download and chat threads...")
-                for t in threads:
-                    t.start()
+                dl_future = run_in_thread(download_thread_fn, name="VideoDownload")
+                chat_future = run_in_thread(parti_chat, platform, username, stream_dir, stop_event, chat_saved,
+                                            chat_json, name="ChatCollection")
                 
                 try:
                     # Wait for download to complete (which will then signal chat to stop)
-                    consecutive_offline = 0
-                    download_check_interval = 1  # Check download status every 1 second
+                    last_live_check = time.monotonic()
                     
-                    while not download_complete.is_set():
-                        time.sleep(download_check_interval)
+                    # Block until the download finishes, waking up periodically to check on the stream
+                    while not download_complete.wait(timeout=DOWNLOAD_CHECK_INTERVAL):
+                        if shutdown_event.is_set():
+                            break
                         
                         # Periodically check if threads are still alive
-                        if not dl_thread.is_alive() and not download_complete.is_set():
+                        if dl_future.done() and not download_complete.is_set():
                             logger.warning("Download thread ended without setting download_complete flag")
                             on_download_complete(False)
                             break
                         
+                        # The live status only needs checking every so often, not on every wakeup
+                        now = time.monotonic()
+                        if now - last_live_check < LIVE_CHECK_INTERVAL:
+                            continue
+                        last_live_check = now
+                        
                         # If stream goes offline, this might be a good time to stop
                         try:
-                            if not isLive(user_id):
-                                consecutive_offline += 1
-                                if consecutive_offline >= MAX_OFFLINE_CHECKS:
-                                    logger.info(f"Stream appears to have ended (offline for {consecutive_offline} checks), signaling stop...")
+                            if not getLiveStatus(platform, username):
+                                offline_count += 1
+                                if offline_count >= MAX_OFFLINE_CHECKS:
+                                    logger.info("Stream appears to have ended (offline for %d checks), signaling stop...", offline_count)
                                     if not download_complete.is_set():
                                         on_download_complete(True)  # Treat as success even if partial
                                     break
                             else:
-                                consecutive_offline = 0  # Reset counter if stream is back online
+                                offline_count = 0  # Reset counter if stream is back online
                         except Exception as e:
-                            logger.warning(f"Error checking live status: {e}")
+                            logger.warning("Error checking live status: %s", e)
+                    
+                    if shutdown_event.is_set():
+                        logger.info("Shutdown requested, shutting down...")
+                        stop_event.set()  # Signal threads to stop
+                        
+                        # No need to wait for threads since they're daemons
+                        logger.info("Shutting down immediately. Daemon threads will be terminated.")
+                        break
                     
-                    # After wait period, signal the chat thread to stop
-                    logger.info("Post-download wait period complete, will stop chat collection")
+                    # Download is over, signal the chat thread to stop
+                    logger.info("Recording finished, will stop chat collection")
                     stop_event.set()
                     logger.info("Stop signal sent to chat thread")
                     
                     # Download is now complete, wait for chat thread to finish
                     logger.info(f"Waiting for chat collection to complete (timeout: {CHAT_SHUTDOWN_TIMEOUT}s)...")
                     
-                    # Use a polling approach rather than join() to improve responsiveness
-                    chat_start_wait = time.time()
-                    while chat_thread.is_alive() and (time.time() - chat_start_wait) < CHAT_SHUTDOWN_TIMEOUT:
-                        time.sleep(0.5)  # Check every half second
-                    
-                    # Check final status
-                    if chat_thread.is_alive():
+                    try:
+                        chat_future.result(timeout=CHAT_SHUTDOWN_TIMEOUT)
+                    except FutureTimeoutError:
                         logger.warning("Chat thread did not terminate in time. Thread will be abandoned.")
                         
-                        # Check if the chat json file exists - if not, we might want to wait a bit longer
-                        # as the thread could be in the process of saving
-                        final_chat_file = os.path.join(stream_dir, "chat.json")
-                        if not os.path.exists(final_chat_file):
-                            logger.info("No final chat file detected, waiting an additional 5 seconds...")
-                            time.sleep(5)
+                        # The thread could be in the process of saving, give it a bit longer to finish
+                        if not chat_saved.is_set():
+                            logger.info("Final chat file not written yet, waiting up to 5 more seconds...")
+                            chat_saved.wait(timeout=5)
                         
                         # Note: Since we've set the thread as daemon, it won't prevent program exit
                         logger.info("Forcibly ending the current recording session...")
+                    except Exception as e:
+                        logger.error(f"Chat collection failed: {e}")
+                        logger.debug(traceback.format_exc())
                     else:
                         logger.info("Chat collection completed successfully")
                     
@@ -249,6 +305,9 @@ def archive_stream(parti_url, base_dir="."):
                         logger.info(f"Directory {stream_dir} is empty, deleting it")
                         delete_directory(stream_dir)
                     
+                    # Make sure the next check sees the current status rather than a cached one
+                    isLive.cache_clear()
+                    
                     print(f"Download completed: {stream_dir}")  # Always show this
                         
                 except KeyboardInterrupt:
@@ -263,19 +322,22 @@ def archive_stream(parti_url, base_dir="."):
             else:
                 # Streamer is not live
                 offline_count += 1
-                logger.info(f"Streamer not online (check {offline_count}), sleeping for {DELAY} seconds")
-                time.sleep(DELAY)
-                
-                # No special handling needed here
+                logger.info("Streamer not online (check %d), sleeping for %d seconds", offline_count, DELAY)
+                if shutdown_event.wait(DELAY):
+                    break
                 
         except KeyboardInterrupt:
             logger.info("Shutting down archiver...")
             break
         except Exception as e:
             print(f"Error: {e}")  # Always show errors
-            logger.error(f"Error in main archiver loop: {e}")
+            logger.error("Error in main archiver loop: %s", e)
             logger.debug(traceback.format_exc())
-            time.sleep(DELAY)  # Sleep to avoid rapid error loops
+            if shutdown_event.wait(DELAY):  # Sleep to avoid rapid error loops
+                break
+    
+    if shutdown_event.is_set():
+        logger.info("Shutting down archiver...")
 
 def parse_args():
     """Parse command line arguments"""
@@ -292,22 +354,31 @@ def parse_args():
                         default=".", 
                         help="Directory where streams should be stored (default: current directory)")
     
+    parser.add_argument("--chat-json", 
+                        action="store_true", 
+                        help="Also save each stream's chat as a chat.json array (it is always saved to chat.jsonl)")
+    
     return parser.parse_args()
 
 if __name__ == "__main__":
     # Parse command line arguments
     args = parse_args()
     
-    # Set up logging based on verbosity
-    setup_logging(args.verbose)
+    # Set up logging based on verbosity, flushing queued records on exit
+    listener = setup_logging(args.verbose)
+    atexit.register(listener.stop)
     
     # Display minimal startup info
     print(f"Parti Archiver started for: {args.url}")
     if not args.verbose:
         print("Run with -v or --verbose for detailed output")
     
+    # Ctrl+C sets the shutdown event instead of interrupting whatever is running
+    signal.signal(signal.SIGINT, request_shutdown)
+    
     try:
-        archive_stream(args.url, args.dir)
+        archive_stream(args.url, args.dir, chat_json=args.chat_json)
+        print("\nArchiver shut down by user")
     except KeyboardInterrupt:
         print("\nArchiver shut down by user")
     except Exception as e:
@@ -1,15 +1,29 @@
 """Client using the threading API."""
 
 from websockets.sync.client import connect
-from api import getUserId, isLive
+from websockets.exceptions import ConnectionClosed
+from api import getUserId
 from urls import PARTI_WS_URI
+import atexit
 import json
 import logging
 import os
+import queue
+import socket
+import tempfile
 import threading
 import time
 import traceback
 
+# orjson is a lot faster, but only optional so the module still runs without its wheels
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    json_loads = json.loads
+    
+    def json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
 # Configure logger - actual level will be set by archiver.py
 logger = logging.getLogger("chat_monitor")
 
@@ -17,6 +31,10 @@ logger = logging.getLogger("chat_monitor")
 ws_logger = logging.getLogger("websockets")
 ws_logger.setLevel(logging.WARNING)
 
+SAVE_INTERVAL = 30  # Seconds between flushes of the chat log to disk
+SYNC_BYTES = 1 << 20  # Bytes written to the chat log between fsyncs
+WRITE_BATCH = 128  # Most queued lines written to the chat log in one go
+
 headers={
     # "Host": "ws-backend.parti.com",
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:138.0) Gecko/20100101 Firefox/138.0",
@@ -25,7 +43,6 @@ headers={
     "Accept-Encoding": "gzip, deflate, br, zstd",
     "Sec-WebSocket-Version": "13",
     "Origin": "https://parti.com",
-    "Sec-WebSocket-Extensions": "permessage-deflate",
     "Connection": "keep-alive, Upgrade",
     "Sec-Fetch-Dest": "empty",
     "Sec-Fetch-Mode": "websocket",
@@ -35,24 +52,105 @@ headers={
     "Upgrade": "websocket"
 }
 
-def save_chat(msgs, filepath):
-    """Simple direct save of chat messages to file"""
+# Subscription request for a user's public chat, user_id is the only part that changes
+SUBSCRIBE_TEMPLATE = '{{"subscribe_options":{{"ChatPublic":{{"user_id":{}}}}}}}'
+
+def save_chat(log_path, filepath):
+    """
+    Simple direct save of chat messages to file
+    
+    Only used once a session ends, messages are logged to chat.jsonl as they arrive
+    and this turns that log into a single JSON array.
+    
+    Args:
+        log_path: The chat.jsonl log, one message per line
+        filepath: Where to write the JSON array
+    """
+    temp_path = None
     try:
-        # Make sure directory exists
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        
-        # Write directly to the final file
-        with open(filepath, "w", encoding="utf-8") as chat_file:
-            chat_file.write(json.dumps(msgs, indent=4, ensure_ascii=False))
+        # Messages are already JSON, so the array is stitched together rather than re-encoded.
+        # Copied over a line at a time so the whole chat is never held in memory, and written
+        # to a uniquely named file next to the target then renamed, so chat.json is never seen
+        # half written, even if two saves overlap
+        count = 0
+        with open(log_path, "rb") as log_file, tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(filepath) or ".", prefix="chat.", suffix=".tmp", delete=False) as chat_file:
+            temp_path = chat_file.name
+            chat_file.write(b"[")
+            for line in log_file:
+                # A line without its newline is still being written, leave it out
+                if not line.endswith(b"\n"):
+                    break
+                chat_file.write(b",\n" if count else b"\n")
+                chat_file.write(line[:-1])
+                count += 1
+            chat_file.write(b"\n]")
+        os.replace(temp_path, filepath)
         
-        logger.info(f"Saved {len(msgs)} messages to chat file: {filepath}")
+        logger.info(f"Saved {count} messages to chat file: {filepath}")
         return True
     except Exception as e:
         logger.error(f"Error saving chat data to {filepath}: {e}")
         logger.debug(traceback.format_exc())
+        # Don't leave a stray temp file in the session directory
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
         return False
 
-def parti_chat(platform, username, path, stop_event=None):
+def chat_log_writer(chat_log, write_queue):
+    """
+    Write queued chat lines to the log until a None sentinel is received
+    
+    Runs on its own thread so the recv loop never waits on the disk. Whatever has
+    been queued is written with a single call, up to WRITE_BATCH lines at a time.
+    
+    Args:
+        chat_log: Binary file to append to
+        write_queue: Queue of encoded lines, with None to stop
+    """
+    bytes_since_sync = 0
+    last_flush = time.monotonic()
+    done = False
+    
+    while not done:
+        try:
+            batch = [write_queue.get(timeout=SAVE_INTERVAL)]
+        except queue.Empty:
+            batch = []
+        
+        # Drain whatever else is already waiting
+        while batch and batch[-1] is not None and len(batch) < WRITE_BATCH:
+            try:
+                batch.append(write_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        if batch and batch[-1] is None:
+            batch.pop()
+            done = True
+        
+        try:
+            if batch:
+                data = b"".join(batch)
+                chat_log.write(data)
+                bytes_since_sync += len(data)
+            
+            # Periodic flush so a crash loses at most SAVE_INTERVAL seconds of chat
+            now = time.monotonic()
+            if now - last_flush >= SAVE_INTERVAL:
+                chat_log.flush()
+                last_flush = now
+            
+            # Sync to disk in large chunks rather than on every flush
+            if bytes_since_sync >= SYNC_BYTES:
+                chat_log.flush()
+                os.fsync(chat_log.fileno())
+                bytes_since_sync = 0
+        except Exception as e:
+            logger.error(f"Error writing chat log: {e}")
+            logger.debug(traceback.format_exc())
+
+def parti_chat(platform, username, path, stop_event=None, chat_saved=None, emit_json_array=False):
     """
     Monitor Parti chat with immediate termination on stop signal
     
@@ -61,53 +159,109 @@ def parti_chat(platform, username, path, stop_event=None):
         username: The username to follow
         path: Directory to save chat logs
         stop_event: Threading event that signals when to stop
+        chat_saved: Threading event set once the chat files have been written
+        emit_json_array: Also turn chat.jsonl into a chat.json array when done
     """
-    msgs = []
+    msg_count = 0  # Messages live in chat.jsonl, no need to keep them in memory too
     user_id = int(getUserId(platform, username))
     
     # Default to a never-triggering event if none provided
     if stop_event is None:
         stop_event = threading.Event()
     
-    # Define file path
+    # Define file paths. Messages are appended to the JSONL log as they arrive,
+    # chat.json is only written at the end if the array form was asked for
     chat_file = os.path.join(path, "chat.json")
+    chat_log_file = os.path.join(path, "chat.jsonl")
+    
+    # Make sure directory exists, once up front rather than on every save
+    os.makedirs(path, exist_ok=True)
+    chat_log = open(chat_log_file, "ab", buffering=1 << 16)
+    
+    # Disk writes happen on their own thread, the recv loop only queues lines
+    write_queue = queue.SimpleQueue()
+    writer = threading.Thread(target=chat_log_writer, args=(chat_log, write_queue), name="ChatWriter", daemon=True)
+    writer.start()
+    
+    # Closing the log and building chat.json happens exactly once, from whichever of the
+    # finally block below or the exit hook gets there first. The other waits on the lock
+    finish_lock = threading.Lock()
+    finished = False
+    
+    def finish():
+        nonlocal finished
+        with finish_lock:
+            if finished:
+                return
+            
+            # Let the writer finish whatever is still queued
+            write_queue.put(None)
+            writer.join()
+            
+            # The writer syncs every SYNC_BYTES, this final sync covers whatever was written since the last one
+            chat_log.flush()
+            os.fsync(chat_log.fileno())
+            chat_log.close()
+            
+            # Don't leave an empty log behind, it would stop empty sessions from being cleaned up
+            if os.path.getsize(chat_log_file) == 0:
+                os.remove(chat_log_file)
+            
+            # Every message is already in chat.jsonl, only build the array if it's wanted
+            if msg_count:
+                if emit_json_array:
+                    save_chat(chat_log_file, chat_file)
+                logger.info(f"Saved {msg_count} chat messages on exit")
+            else:
+                logger.warning("Chat monitoring stopped, no messages collected")
+            
+            finished = True
+            if chat_saved is not None:
+                chat_saved.set()
     
-    # Save interval for backups
-    last_save_time = time.time()
-    save_interval = 30  # Save backup every 30 seconds
+    # The archiver exits without waiting for this daemon thread, which can cut the
+    # finally block below short, so make sure the collected messages still get written
+    atexit.register(finish)
         
     try:
-        with connect(PARTI_WS_URI, additional_headers=headers, open_timeout=10) as websocket:
-            # Set a timeout so we can periodically check the stop_event
-            websocket.timeout = 1.0  # 1 second timeout
+        # Chat frames are small, so skip permessage-deflate and inflating every frame
+        with connect(PARTI_WS_URI, additional_headers=headers, open_timeout=10, compression=None) as websocket:
+            # Small frames shouldn't sit waiting on Nagle's algorithm
+            if hasattr(websocket, "socket"):
+                websocket.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             
             # Subscribe to the chat
-            websocket.send(json.dumps({"subscribe_options":{"ChatPublic":{"user_id": user_id}}}))
+            websocket.send(SUBSCRIBE_TEMPLATE.format(user_id))
             logger.info(f"Connected to chat for user {user_id}")
             
+            # recv() only returns when a message arrives, so close the connection as soon
+            # as we're told to stop to wake it up instead of waiting for the next message
+            def close_on_stop():
+                stop_event.wait()
+                websocket.close()
+            threading.Thread(target=close_on_stop, name="ChatStop", daemon=True).start()
+            
             # Process messages until told to stop
             while not stop_event.is_set():
                 try:
                     msg = websocket.recv()
-                    if logger.level <= logging.DEBUG:
-                        logger.debug(f"Chat message received: {msg[:100]}...")  # Print first 100 chars in debug mode
-                    
-                    msgs.append(json.loads(msg))
+                    # Lazy %-formatting, so nothing is sliced or formatted unless DEBUG is enabled
+                    logger.debug("Chat message received: %.100s...", msg)  # Print first 100 chars in debug mode
                     
-                    # Periodic backup save
-                    current_time = time.time()
-                    if current_time - last_save_time > save_interval:
-                        save_chat(msgs, chat_file)
-                        last_save_time = current_time
+                    # Frames are already JSON, keep the raw text instead of parsing and re-encoding
+                    # it. Only re-encode the rare frame with a newline, which would break the JSONL
+                    line = msg.encode() if isinstance(msg, str) else msg
+                    if b"\n" in line:
+                        line = json_dumps(json_loads(line))
+                    write_queue.put(line + b"\n")
+                    msg_count += 1
                         
-                except TimeoutError:
-                    # Check stop_event and exit immediately if set
+                except ConnectionClosed as e:
                     if stop_event.is_set():
                         logger.info("Stop event detected, exiting immediately")
-                        break
-                    
-                    # Just continue to next iteration
-                    continue
+                    else:
+                        logger.error(f"WebSocket connection closed: {e}")
+                    break
                 except Exception as e:
                     logger.error(f"Error in WebSocket connection: {e}")
                     logger.debug(traceback.format_exc())
@@ -116,15 +270,12 @@ def parti_chat(platform, username, path, stop_event=None):
         logger.error(f"Error establishing WebSocket connection: {e}")
         logger.debug(traceback.format_exc())
     finally:
-        # Save all collected messages to file on exit
-        if msgs:
-            save_chat(msgs, chat_file)
-            logger.info(f"Saved {len(msgs)} chat messages on exit")
-        else:
-            logger.warning("Chat monitoring stopped, no messages collected")
+        finish()
+        # Only drop the exit hook once everything has been written
+        atexit.unregister(finish)
     
     logger.info("Chat monitoring thread exiting")
-    return msgs
+    return msg_count
 
 if __name__ == "__main__":
     # When running directly as a script
@@ -136,6 +287,7 @@ if __name__ == "__main__":
     parser.add_argument("username", help="Username to monitor")
     parser.add_argument("--output", "-o", default="./chat_output", help="Output directory")
     parser.add_argument("--verbose", "-v", action="store_true", help="Enable verbose output")
+    parser.add_argument("--json", action="store_true", help="Also write chat.json as a single JSON array")
     
     args = parser.parse_args()
     
@@ -159,7 +311,7 @@ if __name__ == "__main__":
     print(f"Monitoring chat for {args.platform}/{args.username}, press Ctrl+C to stop")
     
     try:
-        parti_chat(args.platform, args.username, args.output)
+        parti_chat(args.platform, args.username, args.output, emit_json_array=args.json)
     except KeyboardInterrupt:
         print("\nChat monitoring stopped by user")
         sys.exit(0)
\ No newline at end of file
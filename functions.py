@@ -2,8 +2,11 @@ from urllib.parse import urlparse,quote_plus
 
 import re
 
+_PREFIX_LEN=len("https://parti.com/creator/")
+
 def split_parti_url(link:str)->tuple[str,str]:
-    segments=link[len("https://parti.com/creator/"):].split("/")
+    # Only platform, username and discriminator are used, anything after them is left unsplit and ignored
+    segments=link[_PREFIX_LEN:].split("/",3)
     if len(segments)>2:
         # this requires some strange url encoding, probably liable to break in the future
         return [segments[0]]+[segments[1]+quote_plus("#"+segments[2])]
@@ -10,6 +10,7 @@ logger = logging.getLogger("video_downloader")
 # Constants
 MAX_RETRIES = 3
 RETRY_DELAY = 5  # seconds
+PROGRESS_LOG_BYTES = 100 * 1024 * 1024  # Log progress this often when the total size isn't known
 
 class DownloadError(Exception):
     """Custom exception for download failures"""
@@ -69,55 +70,62 @@ def download_with_callback(link: str, path: str, completion_callback=None, retri
     attempted_retries = 0
     last_error = None
     
+    # Progress callback to monitor download
+    def progress_hook(d):
+        nonlocal file_size, downloaded_bytes, download_started, download_finished, next_log_at
+        
+        if d['status'] == 'downloading':
+            download_started = True
+            downloaded_bytes = d.get('downloaded_bytes', 0)
+            if not file_size and 'total_bytes' in d:
+                file_size = d.get('total_bytes', 0)
+            elif not file_size and 'total_bytes_estimate' in d:
+                file_size = d.get('total_bytes_estimate', 0)
+            
+            # Log progress at 10% intervals, or every PROGRESS_LOG_BYTES for live streams of unknown size.
+            # This is a single integer compare on most calls, yt-dlp calls the hook for every chunk
+            if downloaded_bytes >= next_log_at:
+                if file_size > 0:
+                    progress = downloaded_bytes / file_size * 100
+                    logger.info(f"Download progress: {progress:.1f}% ({downloaded_bytes/(1024*1024):.1f} MB)")
+                    next_log_at = downloaded_bytes + file_size // 10
+                else:
+                    logger.info(f"Download progress: {downloaded_bytes/(1024*1024):.1f} MB")
+                    next_log_at = downloaded_bytes + PROGRESS_LOG_BYTES
+        
+        elif d['status'] == 'finished':
+            download_finished = True
+            logger.info(f"Download finished. Converting/Processing file...")
+        
+        elif d['status'] == 'error':
+            logger.error(f"Download error: {d.get('error')}")
+    
+    # Configure options with the progress hook once, they're the same for every attempt
+    options = setup_yt_dlp_options(path)
+    options['progress_hooks'] = [progress_hook]
+    # No special handling for 404 errors here, let normal error handling work
+    
+    # Check log level to adjust yt-dlp verbosity
+    if logger.level <= logging.DEBUG:
+        options['verbose'] = True
+        options['quiet'] = False
+        options['no_warnings'] = False
+    
     while attempted_retries <= retries and not download_success:
         # If this is a retry, log and wait
         if attempted_retries > 0:
             logger.warning(f"Retry attempt {attempted_retries}/{retries} after error: {last_error}")
             time.sleep(RETRY_DELAY * attempted_retries)  # Increasing delay on each retry
         
-        # Progress callback to monitor download
+        # Progress state, reset at the start of every attempt
         file_size = 0
         downloaded_bytes = 0
         download_started = False
         download_finished = False
-        
-        def progress_hook(d):
-            nonlocal file_size, downloaded_bytes, download_started, download_finished
-            
-            if d['status'] == 'downloading':
-                download_started = True
-                downloaded_bytes = d.get('downloaded_bytes', 0)
-                if not file_size and 'total_bytes' in d:
-                    file_size = d.get('total_bytes', 0)
-                elif not file_size and 'total_bytes_estimate' in d:
-                    file_size = d.get('total_bytes_estimate', 0)
-                
-                # Log progress at 10% intervals
-                if file_size > 0:
-                    progress = downloaded_bytes / file_size * 100
-                    if progress % 10 < 1:  # Log roughly every 10%
-                        logger.info(f"Download progress: {progress:.1f}% ({downloaded_bytes/(1024*1024):.1f} MB)")
-            
-            elif d['status'] == 'finished':
-                download_finished = True
-                logger.info(f"Download finished. Converting/Processing file...")
-            
-            elif d['status'] == 'error':
-                logger.error(f"Download error: {d.get('error')}")
+        next_log_at = 0  # Byte count at which progress is logged next
         
         try:
-            # Configure options with the progress hook
-            options = setup_yt_dlp_options(path)
-            options['progress_hooks'] = [progress_hook]
-            # No special handling for 404 errors here, let normal error handling work
-            
-            # Check log level to adjust yt-dlp verbosity
-            if logger.level <= logging.DEBUG:
-                options['verbose'] = True
-                options['quiet'] = False
-                options['no_warnings'] = False
-            
-            # Create a YouTube DL instance
+            # Create a fresh YouTube DL instance, a failed attempt leaves its error return code set
             dl = yt_dlp.YoutubeDL(options)
             
             # Attempt to extract info first to validate the URL
@@ -128,7 +136,6 @@ def download_with_callback(link: str, path: str, completion_callback=None, retri
                     logger.error("Could not extract info from URL")
                     raise DownloadError("Could not extract info from URL")
             except Exception as e:
-                logger.error(f"Error extracting info: {e}")
                 # Log but don't do special handling for 404 errors
                 logger.error(f"Error extracting info: {e}")
                 raise DownloadError(f"Invalid URL or content unavailable: {e}")